@@ -1,63 +1,162 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import torch
 import numpy as np
 import chess
-from src.model import ChessBlunderCNN
+from src.model import ChessBlunderCNN, freeze_for_inference, default_quantized_engine
+from src.bitboards import board_to_tensor
 import os
+import functools
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# Per-request tensors are tiny (batch <= ~40 of 12x8x8), so intra-op thread
+# fan-out costs more than it saves. Run single-threaded and scale with
+# uvicorn workers instead (OMP/MKL_NUM_THREADS=1 are set in the Dockerfile).
+INFERENCE_THREADS = 1
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs in each uvicorn worker process once it has started, before it
+    # accepts traffic; nothing model-related happens at import time.
+    # Thread pinning lives here too: the module can be imported twice per
+    # process (__main__/__mp_main__ and src.api), and torch raises if
+    # set_num_interop_threads is called again.
+    torch.set_num_threads(INFERENCE_THREADS)
+    torch.set_num_interop_threads(INFERENCE_THREADS)
+    load_model()
+    warm_up()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Input Schema
 class PredictionRequest(BaseModel):
     fen: str
     elo: int
 
+# Response Schemas
+# Declaring them lets FastAPI serialize straight to JSON bytes with
+# pydantic-core instead of walking the result through jsonable_encoder.
+class PredictionResponse(BaseModel):
+    human_error_probability: float
+
+class MovePrediction(BaseModel):
+    from_square: str = Field(alias="from")
+    to: str
+    opponent_error_probability: float
+    opponent_error_delta: float
+    san: str
+
+class MovesResponse(BaseModel):
+    moves: list[MovePrediction]
+
 # Load Model
 MODEL_PATH = "models/human-chess-blunder-cnn"
+# Written by src/export_model.py (and at the end of training)
+ONNX_PATH = os.path.join(MODEL_PATH, "model.onnx")
+TORCHSCRIPT_PATH = os.path.join(MODEL_PATH, "model_frozen.pt")
+# Written by src/quantize.py; only exists if quantization was opted into
+INT8_PATH = os.path.join(MODEL_PATH, "model_int8.pt")
 device = torch.device("cpu") # CPU for inference
+ELO_BUCKET = 50 # predict_single results are cached per (position, rounded elo)
 model = None
+session = None # onnxruntime session, preferred over the torch model when available
+WARMUP_BATCH_SIZES = (1, 32) # /predict and a typical /predict_moves batch
+WARMUP_ROUNDS = 3
 
-print("Loading model...")
-try:
-    if os.path.exists(MODEL_PATH):
-        model = ChessBlunderCNN.from_pretrained(MODEL_PATH).to(device)
-        model.eval()
-        print("Model loaded from local path.")
-    else:
-        print(f"Model not found at {MODEL_PATH}. Prediction endpoints will fail until trained.")
-except Exception as e:
-    print(f"Failed to load model: {e}")
+def load_model():
+    global model, session
+    print("Loading model...")
+    try:
+        if os.path.exists(INT8_PATH):
+            torch.backends.quantized.engine = default_quantized_engine()
+            model = torch.jit.load(INT8_PATH, map_location=device)
+            print("Model loaded from int8 TorchScript.")
+        elif ort is not None and os.path.exists(ONNX_PATH):
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = INFERENCE_THREADS
+            options.inter_op_num_threads = INFERENCE_THREADS
+            session = ort.InferenceSession(ONNX_PATH, options, providers=["CPUExecutionProvider"])
+            print("Model loaded with ONNX Runtime.")
+        elif os.path.exists(TORCHSCRIPT_PATH):
+            model = torch.jit.load(TORCHSCRIPT_PATH, map_location=device)
+            print("Model loaded from frozen TorchScript.")
+        elif os.path.exists(MODEL_PATH):
+            model = ChessBlunderCNN.from_pretrained(MODEL_PATH).to(device)
+            model = freeze_for_inference(model)
+            print("Model loaded from local path and compiled with TorchScript.")
+        else:
+            print(f"Model not found at {MODEL_PATH}. Prediction endpoints will fail until trained.")
+    
+        if model is not None:
+            model = torch.jit.optimize_for_inference(model)
+    except Exception as e:
+        print(f"Failed to load model: {e}")
 
 # Helper Functions
-def fen_to_tensor(fen):
-    board = chess.Board(fen)
-    tensor = np.zeros((12, 8, 8), dtype=np.float32)
-    piece_map = {
-        chess.PAWN: 0, chess.KNIGHT: 1, chess.BISHOP: 2,
-        chess.ROOK: 3, chess.QUEEN: 4, chess.KING: 5
-    }
-    for square, piece in board.piece_map().items():
-        rank = chess.square_rank(square)
-        file = chess.square_file(square)
-        layer = piece_map[piece.piece_type]
-        if piece.color == chess.BLACK:
-            layer += 6
-        tensor[layer, rank, file] = 1.0
-    return torch.from_numpy(tensor).unsqueeze(0)
-
-def predict_single(fen, elo):
+def run_model(boards, elos):
+    """Runs (N, 12, 8, 8) boards and (N, 1) normalized elos, returns (N,) probabilities."""
+    if session is not None:
+        return session.run(None, {"board": boards, "elo": elos})[0][:, 0]
     if model is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
-    board_tensor = fen_to_tensor(fen).to(device)
-    elo_tensor = torch.tensor([[elo / 3000.0]], dtype=torch.float32).to(device)
+    board_tensor = torch.from_numpy(boards).to(device)
+    elo_tensor = torch.from_numpy(elos).to(device)
     
-    with torch.no_grad():
-        probability = model(board_tensor, elo_tensor).item()
-    return probability
+    with torch.inference_mode():
+        return model(board_tensor, elo_tensor)[:, 0].cpu().numpy()
+
+def warm_up():
+    """
+    Runs dummy batches through the loaded backend so kernel selection,
+    JIT profiling and allocator growth happen before the first request.
+    """
+    if model is None and session is None:
+        return
+    for batch_size in WARMUP_BATCH_SIZES:
+        boards = np.zeros((batch_size, 12, 8, 8), dtype=np.float32)
+        elos = np.zeros((batch_size, 1), dtype=np.float32)
+        for _ in range(WARMUP_ROUNDS):
+            run_model(boards, elos)
+    print("Model warmed up.")
+
+def position_key(fen):
+    """Placement, turn, castling and en passant: the FEN fields that define the position."""
+    return " ".join(fen.split(" ")[:4])
+
+@functools.lru_cache(maxsize=4096)
+def legal_moves_with_san(fen_core):
+    """Legal moves and their SAN for a position, cached for repeated heatmap requests."""
+    board = chess.Board(fen_core)
+    moves = tuple(board.legal_moves)
+    return moves, tuple(board.san(move) for move in moves)
+
+def predict_single(fen, elo):
+    elo_bucket = int(round(elo / ELO_BUCKET)) * ELO_BUCKET
+    return _predict_single_cached(position_key(fen), elo_bucket)
+
+@functools.lru_cache(maxsize=10_000)
+def _predict_single_cached(fen_core, elo):
+    # The model only sees piece placement; BaseBoard skips full FEN validation
+    return predict_single_board(chess.BaseBoard(fen_core.split(" ", 1)[0]), elo)
+
+def predict_single_board(board, elo):
+    """Like predict_single, for callers that already hold a chess.Board (or BaseBoard)."""
+    return predict_batch(board_to_tensor(board)[np.newaxis], elo)[0]
+
+def predict_batch(boards, elo):
+    """Scores stacked (N, 12, 8, 8) positions for the same Elo with a single forward pass."""
+    elos = np.full((len(boards), 1), elo / 3000.0, dtype=np.float32)
+    return run_model(boards, elos).tolist()
 
 def flip_fen_turn(fen):
     parts = fen.split(" ")
@@ -69,7 +168,7 @@ def health_check():
     return {"status": "ok"}
 
 # Endpoints
-@app.post("/predict")
+@app.post("/predict", response_model=PredictionResponse)
 def predict_endpoint(req: PredictionRequest):
     try:
         prob = predict_single(req.fen, req.elo)
@@ -77,7 +176,7 @@ def predict_endpoint(req: PredictionRequest):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/predict_moves")
+@app.post("/predict_moves", response_model=MovesResponse)
 def predict_moves_endpoint(req: PredictionRequest):
     """
     Simulates legal moves and predicts opponent error probability for each.
@@ -85,29 +184,35 @@ def predict_moves_endpoint(req: PredictionRequest):
     """
     try:
         board = chess.Board(req.fen)
-        legal_moves = list(board.legal_moves)
+        legal_moves, sans = legal_moves_with_san(position_key(req.fen))
         
         # Baseline: Probability of opponent error in current position (if it were their turn)
         # We simulate "opponent's view" by flipping turn, though technically we want
         # to know "If I make move X, what is the prob opponent blunders?"
         # So we look at the resulting FENs.
         
-        results = []
+        if not legal_moves:
+            return {"moves": []}
+        
+        # Successor positions for every legal move, scored in one forward pass.
+        boards = []
         for move in legal_moves:
             board.push(move)
             # Now it is opponent's turn. Predict their blunder prob.
-            try:
-                prob = predict_single(board.fen(), req.elo)
-                results.append({
-                    "from": chess.square_name(move.from_square),
-                    "to": chess.square_name(move.to_square),
-                    "opponent_error_probability": prob,
-                    "opponent_error_delta": prob, # Simplified for now
-                    "san": board.peek().san()
-                })
-            except:
-                pass 
+            boards.append(board_to_tensor(board))
             board.pop()
+        
+        probs = predict_batch(np.stack(boards), req.elo)
+        
+        results = []
+        for move, san, prob in zip(legal_moves, sans, probs):
+            results.append({
+                "from": chess.square_name(move.from_square),
+                "to": chess.square_name(move.to_square),
+                "opponent_error_probability": prob,
+                "opponent_error_delta": prob, # Simplified for now
+                "san": san
+            })
             
         # Sort by highest error probability (best traps)
         results.sort(key=lambda x: x["opponent_error_probability"], reverse=True)
@@ -126,4 +231,7 @@ else:
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=7860)
+    # Each worker is a separate process with its own model copy;
+    # set WEB_CONCURRENCY to scale out (see Dockerfile).
+    uvicorn.run("src.api:app", host="0.0.0.0", port=7860,
+                workers=int(os.environ.get("WEB_CONCURRENCY", 1)))
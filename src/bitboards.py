@@ -0,0 +1,133 @@
+import numpy as np
+import chess
+
+# Packed position encoding shared by dataset.py, process_data.py and the API:
+# 12 uint64 masks per board, one per piece plane. Kept free of torch and
+# HF datasets so data generation and inference don't need them.
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Batch FEN parsing (fens_to_bitboards): placement characters -> plane index,
+# in the same P, N, B, R, Q, K / white-then-black order as board_to_bitboards.
+# Anything else (the '1' each empty square expands to) maps past the last plane.
+_EMPTY_SQUARE = 12
+_PIECE_LUT = np.full(256, _EMPTY_SQUARE, dtype=np.uint8)
+for _i, _symbol in enumerate("PNBRQKpnbrqk"):
+    _PIECE_LUT[ord(_symbol)] = _i
+# "3" -> "111" etc.: a well-formed placement becomes 8 ranks of 8 chars
+# joined by '/', 71 chars in all
+_EXPAND_FEN = str.maketrans({str(n): "1" * n for n in range(1, 9)})
+_EXPANDED_LEN = 8 * 9 - 1
+FEN_BATCH_SIZE = 65_536 # bounds the (batch, 12, 64) one-hot intermediate to ~50 MB
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _scan_placements(chars, ends, lut, out):
+        """
+        Compiled FEN scan behind fens_to_bitboards: chars holds the FENs
+        back to back, FEN i ending at ends[i]. Sets out[i] (zeroed (N, 12)
+        uint64) and returns the index of the first malformed FEN, or -1.
+        """
+        start = 0
+        for i in range(ends.size):
+            rank = 7
+            file = 0
+            for j in range(start, ends[i]):
+                c = chars[j]
+                if c == 32: # ' ': end of the placement field
+                    break
+                if c == 47: # '/'
+                    if file != 8:
+                        return i
+                    rank -= 1
+                    file = 0
+                elif 49 <= c <= 56: # '1'..'8'
+                    file += c - 48
+                elif lut[c] < 12 and file < 8 and rank >= 0:
+                    out[i, lut[c]] |= np.uint64(1) << np.uint64(rank * 8 + file)
+                    file += 1
+                else:
+                    return i
+            if rank != 0 or file != 8:
+                return i
+            start = ends[i]
+        return -1
+
+def board_to_bitboards(board):
+    """
+    Packs a chess.Board into 12 uint64 bitboards, one per piece plane.
+    96 bytes per position; bitboards_to_planes() expands them to (12, 8, 8).
+    """
+    # Map pieces to layers: P, N, B, R, Q, K (White: 0-5, Black: 6-11).
+    # Piece and colour masks are read once and combined directly rather than
+    # going through twelve board.pieces_mask() calls.
+    black, white = board.occupied_co # indexed by colour, chess.BLACK == 0
+    pieces = (board.pawns, board.knights, board.bishops,
+              board.rooks, board.queens, board.kings)
+    return np.array([mask & white for mask in pieces] +
+                    [mask & black for mask in pieces], dtype='<u8')
+
+def bitboards_to_planes(bitboards):
+    """Unpacks (..., 12) uint64 bitboards into (..., 12, 8, 8) uint8 planes."""
+    # Square index is rank * 8 + file (a1 = bit 0), so unpacking little-endian
+    # bits and reshaping gives (C, H, W) = (12, rank, file).
+    # Note: Keras model was (8,8,12), PyTorch expects (Channels, H, W) -> (12, 8, 8)
+    bitboards = np.ascontiguousarray(bitboards, dtype='<u8')
+    bits = np.unpackbits(bitboards.view(np.uint8), axis=-1, bitorder='little')
+    return bits.reshape(bitboards.shape[:-1] + (12, 8, 8))
+
+def board_to_tensor(board):
+    """
+    Converts a chess.Board to a (12, 8, 8) float32 array.
+    Use this when a board is already at hand (e.g. inside push/pop loops)
+    to skip a FEN serialize/parse round-trip.
+    """
+    return bitboards_to_planes(board_to_bitboards(board)).astype(np.float32)
+
+def fen_to_bitboards(fen):
+    # Only piece placement matters, so skip chess.Board's parsing and
+    # validation of turn, castling rights and en passant.
+    return board_to_bitboards(chess.BaseBoard(fen.split(" ", 1)[0]))
+
+def fens_to_bitboards(fens):
+    """
+    Vectorized fen_to_bitboards over a sequence of FENs: returns (N, 12) uint64.
+    Only the placement field is read. Skips building a chess.BaseBoard per
+    position, which dominates load time for large CSVs. Uses a compiled
+    byte scan when numba is installed, a NumPy lookup-table pass otherwise.
+    """
+    if numba is not None:
+        # One buffer for all FENs; no per-FEN split or digit expansion
+        chars = np.frombuffer("".join(fens).encode("ascii"), dtype=np.uint8)
+        ends = np.cumsum(np.fromiter(map(len, fens), dtype=np.int64, count=len(fens)))
+        out = np.zeros((len(fens), 12), dtype='<u8')
+        bad = _scan_placements(chars, ends, _PIECE_LUT, out)
+        if bad >= 0:
+            raise ValueError(f"malformed FEN placement field: {fens[bad]!r}")
+        return out
+    
+    out = np.empty((len(fens), 12), dtype='<u8')
+    planes = np.arange(12, dtype=np.uint8)[:, np.newaxis]
+    for start in range(0, len(fens), FEN_BATCH_SIZE):
+        batch = fens[start:start + FEN_BATCH_SIZE]
+        expanded = [fen.split(" ", 1)[0].translate(_EXPAND_FEN) + "/" for fen in batch]
+        lengths = np.fromiter(map(len, expanded), dtype=np.int64, count=len(batch))
+        bad = np.flatnonzero(lengths != _EXPANDED_LEN + 1)
+        if bad.size:
+            raise ValueError(f"malformed FEN placement field: {batch[bad[0]]!r}")
+        # (batch, rank, 9): eight squares then the rank separator
+        chars = np.frombuffer("".join(expanded).encode("ascii"), dtype=np.uint8).reshape(-1, 8, 9)
+        squares = chars[:, :, :8]
+        bad = np.flatnonzero((chars[:, :, 8] != ord("/")).any(axis=1) |
+                             ((_PIECE_LUT[squares] == _EMPTY_SQUARE) & (squares != ord("1"))).any(axis=(1, 2)))
+        if bad.size:
+            raise ValueError(f"malformed FEN placement field: {batch[bad[0]]!r}")
+        # FEN lists rank 8 first; flip so square index is rank * 8 + file
+        squares = squares[:, ::-1, :].reshape(-1, 1, 64)
+        one_hot = _PIECE_LUT[squares] == planes # (batch, 12, 64)
+        packed = np.packbits(one_hot, axis=-1, bitorder='little') # (batch, 12, 8)
+        out[start:start + len(batch)] = packed.view('<u8')[..., 0]
+    return out
@@ -1,68 +1,96 @@
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
 import numpy as np
 import chess
 from datasets import load_dataset
 import pandas as pd
 
-def fen_to_tensor(fen):
+# board_to_tensor is re-exported for existing callers
+if __package__: # imported as src.dataset
+    from .bitboards import board_to_tensor, bitboards_to_planes, fens_to_bitboards
+else:
+    from bitboards import board_to_tensor, bitboards_to_planes, fens_to_bitboards
+
+def load_csv(data_file):
     """
-    Converts a FEN string to a PyTorch tensor (12, 8, 8).
-    Represents the board state.
+    Reads the processed CSV (or the Parquet file process_data.py writes) into packed arrays:
+    bitboards (N, 12) uint64, elo (N,) int16, is_blunder (N,) uint8.
+    This is also the layout of the .npz written by prepare_dataset.py.
     """
-    board = chess.Board(fen)
-    tensor = np.zeros((12, 8, 8), dtype=np.float32)
+    # Load using pandas for simplicity with local files, 
+    # or use datasets.load_dataset('csv', data_files=data_file) if streaming needed.
+    # Given the file size, pandas is fine and easier to debug for now.
+    # Only the columns the model uses are parsed.
+    columns = ['fen', 'elo', 'is_blunder']
+    if data_file.endswith(".parquet"):
+        df = pd.read_parquet(data_file, columns=columns)
+    else:
+        df = pd.read_csv(data_file, usecols=columns)
+    # Filter out potential NaNs or bad rows
+    df = df.dropna(subset=columns)
     
-    # Map pieces to layers: P, N, B, R, Q, K (White: 0-5, Black: 6-11)
-    # Note: Keras model was (8,8,12), PyTorch expects (Channels, H, W) -> (12, 8, 8)
-    piece_map = {
-        chess.PAWN: 0, chess.KNIGHT: 1, chess.BISHOP: 2,
-        chess.ROOK: 3, chess.QUEEN: 4, chess.KING: 5
-    }
+    # Pull raw NumPy columns once; nothing below goes through pandas indexing.
+    fens = df['fen'].to_numpy()
+    elos = df['elo'].to_numpy(dtype=np.int16)
+    labels = df['is_blunder'].to_numpy(dtype=np.uint8)
+    del df
     
-    for square, piece in board.piece_map().items():
-        rank = chess.square_rank(square)
-        file = chess.square_file(square)
-        layer = piece_map[piece.piece_type]
-        if piece.color == chess.BLACK:
-            layer += 6
-        tensor[layer, rank, file] = 1.0 # (C, H, W)
-        
-    return tensor
+    bitboards = fens_to_bitboards(fens)
+    
+    return {"bitboards": bitboards, "elo": elos, "is_blunder": labels}
 
 class HumanChessDataset(Dataset):
     def __init__(self, data_file):
         """
         Args:
-            data_file (str): Path to the CSV file.
+            data_file (str): Path to the CSV/Parquet file, or the packed .npz
+                written by prepare_dataset.py (skips FEN parsing entirely).
         """
-        # Load using pandas for simplicity with local files, 
-        # or use datasets.load_dataset('csv', data_files=data_file) if streaming needed.
-        # Given the file size, pandas is fine and easier to debug for now.
         print(f"Loading data from {data_file}...")
-        self.df = pd.read_csv(data_file)
-        # Filter out potential NaNs or bad rows
-        self.df = self.df.dropna(subset=['fen', 'elo', 'is_blunder'])
-        print(f"Loaded {len(self.df)} samples.")
+        if data_file.endswith(".npz"):
+            # npz members are read into RAM (np.load cannot memory-map them),
+            # which is cheap at 96 bytes per position.
+            with np.load(data_file) as npz:
+                data = dict(npz)
+        else:
+            data = load_csv(data_file)
+        
+        # Structure of arrays: __getitem__ is plain indexing, no FEN parsing.
+        self.bitboards = data["bitboards"]
+        # Elo (Normalized)
+        self.elos = (data["elo"] / 3000.0).astype(np.float32)
+        # is_blunder is 0 or 1
+        self.labels = data["is_blunder"].astype(np.float32)
+        print(f"Loaded {len(self.labels)} samples.")
 
     def __len__(self):
-        return len(self.df)
+        return len(self.labels)
 
     def __getitem__(self, idx):
-        row = self.df.iloc[idx]
-        
-        # Inputs
-        fen = row['fen']
-        elo = float(row['elo'])
+        # Planes stay uint8 (0/1): batches are 4x smaller to collate and copy,
+        # and the consumer casts with .float() once they are on the device.
+        if isinstance(idx, list):
+            # A whole batch from batch_loader(): one vectorized unpack, no collate
+            idx = np.asarray(idx)
+            return (torch.from_numpy(bitboards_to_planes(self.bitboards[idx])),
+                    torch.from_numpy(self.elos[idx, np.newaxis]),
+                    torch.from_numpy(self.labels[idx, np.newaxis]))
         
-        # Board Tensor
-        board_tensor = torch.from_numpy(fen_to_tensor(fen))
-        
-        # Elo Tensor (Normalized)
-        elo_tensor = torch.tensor([elo / 3000.0], dtype=torch.float32)
-        
-        # Target
-        # is_blunder is 0 or 1
-        label = torch.tensor([float(row['is_blunder'])], dtype=torch.float32)
+        board_tensor = torch.from_numpy(bitboards_to_planes(self.bitboards[idx]))
+        # 1-element slices are views: no Python list, no copy until collate
+        elo_tensor = torch.as_tensor(self.elos[idx:idx + 1])
+        label = torch.as_tensor(self.labels[idx:idx + 1])
         
         return board_tensor, elo_tensor, label
+
+def batch_loader(dataset, batch_size, shuffle=False, **kwargs):
+    """
+    DataLoader that hands the dataset whole lists of indices, so
+    HumanChessDataset (or a Subset of it) builds each batch with one NumPy
+    unpack instead of batch_size __getitem__ calls plus collation.
+    kwargs (num_workers, pin_memory, ...) are passed to DataLoader.
+    """
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    # batch_size=None turns off the DataLoader's own batching and collation
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last=False),
+                      batch_size=None, **kwargs)
@@ -2,6 +2,8 @@ import requests
 import os
 import gzip
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 DATA_DIR = "data/raw"
 # Downloading a small sample of games from Lichess (e.g., from a specific month, but filtered)
@@ -14,13 +16,24 @@ DATA_DIR = "data/raw"
 API_URL = "https://lichess.org/api/games/user/"
 PLAYERS = ["Maia1", "Maia5", "Maia9", "MagnusCarlsen"]
 MAX_GAMES = 200
+MAX_RETRIES = 3
+RATE_LIMIT_WAIT = 60 # Lichess asks clients to wait a full minute after a 429
+LICHESS_TOKEN = os.environ.get("LICHESS_TOKEN") # optional, raises the API rate limit and enables parallel downloads
 
 def download_games(player):
     print(f"Downloading games for {player}...")
     url = f"{API_URL}{player}?max={MAX_GAMES}&perfType=blitz,rapid,classical&pgnInJson=false"
     headers = {"Accept": "application/x-chess-pgn"}
+    if LICHESS_TOKEN:
+        headers["Authorization"] = f"Bearer {LICHESS_TOKEN}"
     try:
-        response = requests.get(url, headers=headers, stream=True)
+        for attempt in range(MAX_RETRIES):
+            response = requests.get(url, headers=headers, stream=True)
+            if response.status_code != 429 or attempt == MAX_RETRIES - 1:
+                break
+            response.close()
+            print(f"Rate limited on {player}, retrying in {RATE_LIMIT_WAIT}s...")
+            time.sleep(RATE_LIMIT_WAIT)
         response.raise_for_status()
         
         filepath = os.path.join(DATA_DIR, f"{player}_games.pgn")
@@ -35,8 +48,11 @@ def main():
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
         
-    for player in PLAYERS:
-        download_games(player)
+    # Lichess asks anonymous clients for one request at a time; parallel
+    # exports would only trip 429s and the minute-long backoff.
+    max_workers = len(PLAYERS) if LICHESS_TOKEN else 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(download_games, PLAYERS))
         
     # Combine them
     with open(os.path.join(DATA_DIR, "combined_games.pgn"), 'wb') as outfile:
@@ -44,7 +60,7 @@ def main():
             filepath = os.path.join(DATA_DIR, f"{player}_games.pgn")
             if os.path.exists(filepath):
                 with open(filepath, 'rb') as infile:
-                    outfile.write(infile.read())
+                    shutil.copyfileobj(infile, outfile, length=1 << 20)
     
     print("Download complete.")
 
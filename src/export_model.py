@@ -0,0 +1,52 @@
+import torch
+import os
+import argparse
+from model import ChessBlunderCNN, BlunderProbability, freeze_for_inference
+
+# Configuration
+MODEL_DIR = "models"
+MODEL_NAME = "human-chess-blunder-cnn"
+ONNX_FILE = "model.onnx"
+TORCHSCRIPT_FILE = "model_frozen.pt"
+
+def export_onnx(model, path):
+    """
+    Exports the CNN to ONNX for onnxruntime inference.
+    Inputs are named "board" (N, 12, 8, 8) and "elo" (N, 1); the batch
+    dimension is dynamic so /predict_moves can score all moves in one call.
+    The output "p" is the probability (sigmoid included).
+    """
+    model = model.to("cpu").eval()
+    example_board = torch.zeros(1, 12, 8, 8)
+    example_elo = torch.zeros(1, 1)
+    torch.onnx.export(
+        BlunderProbability(model).eval(), (example_board, example_elo), path,
+        input_names=["board", "elo"], output_names=["p"],
+        dynamic_axes={"board": {0: "B"}, "elo": {0: "B"}, "p": {0: "B"}},
+        opset_version=17,
+        dynamo=False, # TorchScript exporter writes a single self-contained file
+    )
+    print(f"Exported ONNX model to {path}")
+
+def export_torchscript(model, path):
+    """
+    Saves the frozen TorchScript module, so the API loads it directly instead
+    of tracing and freezing at every startup.
+    """
+    frozen = freeze_for_inference(model.to("cpu"))
+    torch.jit.save(frozen, path)
+    print(f"Exported TorchScript model to {path}")
+
+def export_all(model, out_dir):
+    export_onnx(model, os.path.join(out_dir, ONNX_FILE))
+    export_torchscript(model, os.path.join(out_dir, TORCHSCRIPT_FILE))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default=f"{MODEL_DIR}/{MODEL_NAME}", help="Local path or HF Repo ID")
+    args = parser.parse_args()
+    
+    model = ChessBlunderCNN.from_pretrained(args.model)
+    out_dir = args.model if os.path.isdir(args.model) else f"{MODEL_DIR}/{MODEL_NAME}"
+    os.makedirs(out_dir, exist_ok=True)
+    export_all(model, out_dir)
@@ -1,14 +1,12 @@
 import sys
 import chess
 import chess.engine
-import numpy as np
-import tensorflow as tf
-from tensorflow import keras
 import os
+from src.model import ChessBlunderCNN
 
 # Configuration
 STOCKFISH_PATH = "/opt/homebrew/bin/stockfish"
-MODEL_PATH = "models/human_error_model.keras"
+MODEL_PATH = "models/human-chess-blunder-cnn"
 
 class HumanEngine:
     def __init__(self):
@@ -16,28 +14,12 @@ class HumanEngine:
         self.engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
         self.model = None
         try:
-            self.model = keras.models.load_model(MODEL_PATH)
-            print("info string Loaded Keras model.")
+            self.model = ChessBlunderCNN.from_pretrained(MODEL_PATH)
+            self.model.eval()
+            print("info string Loaded PyTorch model.")
         except:
             print("info string Could not load model. Will play as pure Stockfish.")
 
-    def fen_to_tensor(self, fen):
-        # Same function as in train_model.py
-        board = chess.Board(fen)
-        tensor = np.zeros((8, 8, 12), dtype=np.float32)
-        piece_map = {
-            chess.PAWN: 0, chess.KNIGHT: 1, chess.BISHOP: 2,
-            chess.ROOK: 3, chess.QUEEN: 4, chess.KING: 5
-        }
-        for square, piece in board.piece_map().items():
-            rank = chess.square_rank(square)
-            file = chess.square_file(square)
-            layer = piece_map[piece.piece_type]
-            if piece.color == chess.BLACK:
-                layer += 6
-            tensor[rank, file, layer] = 1.0
-        return tensor
-
     def get_best_move(self, time_limit=1.0):
         # 1. Get candidate moves from Stockfish (MultiPV)
         limit = chess.engine.Limit(time=time_limit)
@@ -8,6 +8,9 @@ class ChessBlunderCNN(nn.Module, PyTorchModelHubMixin):
     A CNN model that takes a chess board state (12x8x8) and an Elo rating
     to predict the probability of a human blunder.
     
+    forward returns logits (train with BCEWithLogitsLoss); wrap the model in
+    BlunderProbability, or apply torch.sigmoid, to get probabilities.
+    
     Mixin enables:
     - model.save_pretrained("path")
     - model.push_to_hub("repo")
@@ -43,7 +46,7 @@ class ChessBlunderCNN(nn.Module, PyTorchModelHubMixin):
         x = self.pool(x)
         
         x = F.relu(self.conv3(x))
-        x = x.view(-1, 128 * 4 * 4) # Flatten
+        x = x.reshape(-1, 128 * 4 * 4) # Flatten (reshape: conv output may be channels_last)
         
         x = F.relu(self.fc_board(x))
         
@@ -55,7 +58,41 @@ class ChessBlunderCNN(nn.Module, PyTorchModelHubMixin):
         z = F.relu(self.fc_combined(combined))
         z = self.dropout(z)
         
-        # Output (Sigmoid for probability)
-        out = torch.sigmoid(self.fc_out(z))
+        # Output (logits; sigmoid is applied by BlunderProbability / the loss)
+        out = self.fc_out(z)
         
         return out
+
+class BlunderProbability(nn.Module):
+    """Applies the sigmoid to ChessBlunderCNN logits; this is what gets exported."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, board, elo):
+        return torch.sigmoid(self.model(board, elo))
+
+def freeze_for_inference(model):
+    """
+    Compiles an eval-mode ChessBlunderCNN to a frozen TorchScript module
+    that returns probabilities.
+    forward has no data-dependent control flow, so tracing is exact; freezing
+    turns the weights into constants so torch.jit.optimize_for_inference can
+    fuse Conv/Linear+ReLU. The frozen module can be saved with torch.jit.save;
+    apply optimize_for_inference after loading, its output does not serialize.
+    """
+    model.eval()
+    device = next(model.parameters()).device
+    example_board = torch.zeros(1, 12, 8, 8, device=device)
+    example_elo = torch.zeros(1, 1, device=device)
+    with torch.no_grad():
+        traced = torch.jit.trace(BlunderProbability(model).eval(), (example_board, example_elo))
+        return torch.jit.freeze(traced)
+
+def default_quantized_engine():
+    """int8 kernel backend: x86 (fbgemm/oneDNN) where available, qnnpack on ARM."""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    return torch.backends.quantized.engine
@@ -1,55 +1,42 @@
 import sys
 import chess
-import numpy as np
-import tensorflow as tf
-from tensorflow import keras
+import torch
+from bitboards import board_to_tensor
+from model import ChessBlunderCNN
 
-MODEL_PATH = "models/human_error_model.keras"
-
-def fen_to_tensor(fen):
-    board = chess.Board(fen)
-    tensor = np.zeros((8, 8, 12), dtype=np.float32)
-    piece_map = {
-        chess.PAWN: 0, chess.KNIGHT: 1, chess.BISHOP: 2,
-        chess.ROOK: 3, chess.QUEEN: 4, chess.KING: 5
-    }
-    for square, piece in board.piece_map().items():
-        rank = chess.square_rank(square)
-        file = chess.square_file(square)
-        layer = piece_map[piece.piece_type]
-        if piece.color == chess.BLACK:
-            layer += 6
-        tensor[rank, file, layer] = 1.0
-    return tensor
+MODEL_PATH = "models/human-chess-blunder-cnn"
+DEFAULT_ELO = 1500
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python src/predict_position.py <FEN_STRING>")
+        print("Usage: python src/predict_position.py <FEN_STRING> [ELO]")
         # Example position (Start pos)
         fen = chess.STARTING_FEN
     else:
         fen = sys.argv[1]
+    elo = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ELO
 
     print(f"Loading model from {MODEL_PATH}...")
     try:
-        model = keras.models.load_model(MODEL_PATH)
+        model = ChessBlunderCNN.from_pretrained(MODEL_PATH)
+        model.eval()
     except Exception as e:
         print(f"Error loading model: {e}")
         return
 
-    print(f"Analyzing Position: {fen}")
+    print(f"Analyzing Position: {fen} (Elo {elo})")
     board = chess.Board(fen)
     print(board)
     print("-" * 20)
 
-    tensor = fen_to_tensor(fen)
-    # Add batch dimension
-    input_tensor = np.expand_dims(tensor, axis=0)
+    # Add batch dimension. The board is already parsed, so skip the FEN round-trip.
+    board_tensor = torch.from_numpy(board_to_tensor(board)).unsqueeze(0)
+    elo_tensor = torch.tensor([[elo / 3000.0]], dtype=torch.float32)
     
-    prediction = model.predict(input_tensor)
-    prob = prediction[0][0]
+    with torch.inference_mode():
+        prob = torch.sigmoid(model(board_tensor, elo_tensor)).item()
     
-    print(f"\nModel Prediction (Probability of Blunder/Error for {board.turn_name}): {prob:.4f}")
+    print(f"\nModel Prediction (Probability of Blunder/Error for {chess.COLOR_NAMES[board.turn]}): {prob:.4f}")
     if prob > 0.5:
         print(">> High likelihood of human error here!")
     else:
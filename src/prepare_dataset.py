@@ -0,0 +1,48 @@
+import numpy as np
+import os
+import argparse
+
+# Configuration
+DATA_FILE = "data/processed/chess_complexity_data.parquet"
+CSV_DATA_FILE = "data/processed/chess_complexity_data.csv" # process_data.py without pyarrow
+PACKED_DATA_FILE = "data/processed/chess_complexity_data.npz" # read by train.py and quantize.py
+
+def rows_data_file():
+    """The Parquet file, or the CSV when only that one exists."""
+    return DATA_FILE if os.path.exists(DATA_FILE) or not os.path.exists(CSV_DATA_FILE) else CSV_DATA_FILE
+
+def resolve_data_file():
+    """Prefers the packed .npz unless the Parquet (or CSV) has been regenerated since."""
+    rows_file = rows_data_file()
+    if os.path.exists(PACKED_DATA_FILE):
+        if not os.path.exists(rows_file) or os.path.getmtime(PACKED_DATA_FILE) >= os.path.getmtime(rows_file):
+            return PACKED_DATA_FILE
+        print(f"{PACKED_DATA_FILE} is older than {rows_file}; rerun prepare_dataset.py to refresh it.")
+    return rows_file
+
+def prepare(data_file=None, output_file=PACKED_DATA_FILE):
+    """
+    One-time conversion of the processed Parquet/CSV into packed bitboards, so
+    training runs no longer parse FEN strings.
+    """
+    # Imported here so the path helpers above stay importable without torch
+    from dataset import load_csv
+    
+    if data_file is None:
+        data_file = rows_data_file()
+    if not os.path.exists(data_file):
+        print(f"Error: {data_file} not found. Please run process_data.py first.")
+        return
+    
+    print(f"Packing {data_file}...")
+    data = load_csv(data_file)
+    np.savez_compressed(output_file, **data)
+    print(f"Saved {len(data['is_blunder'])} positions to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, default=None, help="Processed Parquet/CSV (default: Parquet, else CSV)")
+    parser.add_argument("--output", type=str, default=PACKED_DATA_FILE, help="Packed .npz")
+    args = parser.parse_args()
+    
+    prepare(args.input, args.output)
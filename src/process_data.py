@@ -1,37 +1,172 @@
 import chess
 import chess.pgn
 import chess.engine
-import pandas as pd
+import chess.polyglot
+import csv
 import os
 import multiprocessing
+import struct
+from contextlib import contextmanager
 from functools import partial
 
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
 # Configuration
 STOCKFISH_PATH = "/opt/homebrew/bin/stockfish" # Adjust if needed
 DATA_DIR = "data/raw"
 PROCESSED_DIR = "data/processed"
 PGN_FILE = os.path.join(DATA_DIR, "games.pgn")
-OUTPUT_FILE = os.path.join(PROCESSED_DIR, "chess_complexity_data.csv")
+OUTPUT_FILE = os.path.join(PROCESSED_DIR, "chess_complexity_data.parquet")
+CSV_OUTPUT_FILE = os.path.join(PROCESSED_DIR, "chess_complexity_data.csv") # written instead without pyarrow
+# Same packed layout as prepare_dataset.py; train.py prefers it over the rows files
+PACKED_OUTPUT_FILE = os.path.join(PROCESSED_DIR, "chess_complexity_data.npz")
 DEPTH = 10
+# Lines searched per position. Only the best score and a lookup of the human
+# move are used; humans mostly play one of the top few moves, and any other
+# move gets its own root_moves search at DEPTH, so extra PVs are wasted nodes.
+MULTIPV = 3
 MAX_GAMES = 10000
+# Rows are streamed to OUTPUT_FILE in batches of this size as games finish
+WRITE_BATCH_ROWS = 1024
+ROW_FIELDS = ["fen", "elo", "best_score", "human_score", "score_diff", "is_blunder", "complexity"]
+if pa is not None:
+    ROW_SCHEMA = pa.schema([
+        ("fen", pa.string()), # piece placement only, the part the model reads
+        ("elo", pa.int16()),
+        ("best_score", pa.int32()),
+        ("human_score", pa.int32()),
+        ("score_diff", pa.int32()),
+        ("is_blunder", pa.int8()),
+        ("complexity", pa.int8()),
+    ])
+# Opening moves carry little blunder signal and are the same across many
+# games, so analysis starts at this move. Positions found in the optional
+# Polyglot book below are skipped as well.
+MIN_FULLMOVE = 5
+OPENING_BOOK_PATH = os.path.join(DATA_DIR, "book.bin")
+# Per-worker Stockfish settings. The hash is kept between plies of a game, and
+# 16 MB (~1.6M entries) is plenty for depth-10 searches; reuse across games
+# and workers comes from the shared eval cache below, so RAM goes there rather
+# than into cpu_count private tables. MultiPV is not configurable here:
+# python-chess manages it per analyse() call.
+# One single-threaded engine per pool process (one process per core) scales
+# better than fewer multi-threaded engines. Searches on one engine cannot be
+# overlapped (UCI runs one "go" at a time), and the Python work between them
+# is negligible next to a depth-10 search, so each worker stays sequential.
+ENGINE_HASH_MB = 16
+ENGINE_THREADS = 1
+# Engine scores shared by all workers (and kept across runs), so positions
+# repeated across games, mostly openings, are only analysed once.
+# Keys: "<fen without move counters>" -> best score,
+# "<fen without move counters>|<uci>" -> score of that move. Delete the
+# directory after changing DEPTH.
+# analyse() gets the game history, so Stockfish may score a position as a
+# draw by repetition or the 50-move rule. Such scores depend on how the game
+# got there, so positions near either are analysed without the cache.
+EVAL_CACHE_MAX_HALFMOVE_CLOCK = 80
+EVAL_CACHE_PATH = os.path.join(PROCESSED_DIR, "eval_cache.lmdb")
+EVAL_CACHE_MAP_SIZE = 1 << 34 # upper bound only; the file grows as needed (no writemap)
+SCORE_FORMAT = "<i"
 
-# Global variable for the worker process to hold the engine instance
+# Global variables for the worker process to hold the engine instance and eval cache
 engine = None
+eval_cache = None
+opening_book = None
 
 def init_worker():
     """Initializer for worker processes to create their own Stockfish instance."""
-    global engine
+    global engine, eval_cache, opening_book
     try:
         engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+        engine.configure({"Hash": ENGINE_HASH_MB, "Threads": ENGINE_THREADS})
     except Exception as e:
         print(f"Failed to start Stockfish in worker: {e}")
+    if lmdb is not None:
+        try:
+            # No fsync per commit: every worker writes after each ply, and a
+            # cache lost in a crash is simply rebuilt.
+            eval_cache = lmdb.open(EVAL_CACHE_PATH, map_size=EVAL_CACHE_MAP_SIZE, sync=False)
+        except Exception as e:
+            print(f"Failed to open eval cache, analysing without it: {e}")
+    if os.path.exists(OPENING_BOOK_PATH):
+        opening_book = chess.polyglot.open_reader(OPENING_BOOK_PATH)
+
+def is_book_position(board):
+    return opening_book is not None and opening_book.get(board) is not None
+
+def has_repeated_position(board):
+    """True if a position since the last capture or pawn move occurs twice in the game."""
+    # Earlier positions can't recur, so only halfmove_clock plies are replayed
+    history = board.copy(stack=board.halfmove_clock)
+    seen = set()
+    while True:
+        key = chess.polyglot.zobrist_hash(history)
+        if key in seen:
+            return True
+        seen.add(key)
+        if not history.move_stack:
+            return False
+        history.pop()
+
+def cache_get(*keys):
+    """Cached scores for keys (None where missing)."""
+    if eval_cache is None:
+        return [None] * len(keys)
+    with eval_cache.begin() as txn:
+        values = [txn.get(key.encode()) for key in keys]
+    return [None if v is None else struct.unpack(SCORE_FORMAT, v)[0] for v in values]
+
+def cache_put(scores):
+    """Stores a {key: score} dict in one write transaction."""
+    if eval_cache is None or not scores:
+        return
+    with eval_cache.begin(write=True) as txn:
+        for key, score in scores.items():
+            txn.put(key.encode(), struct.pack(SCORE_FORMAT, score))
 
-def analyze_position_worker(board):
+class EloFilterVisitor(chess.pgn.GameBuilder):
+    """
+    Builds games like chess.pgn.read_game, but skips the movetext of any game
+    whose WhiteElo/BlackElo is missing or not a number. Those would be
+    rejected by process_single_game anyway; skipping them at the header
+    stage avoids parsing their moves. Skipped games come back as
+    chess.pgn.SKIP instead of a Game.
+    """
+    def begin_game(self):
+        super().begin_game()
+        self.skipped = False
+
+    def end_headers(self):
+        try:
+            int(self.game.headers.get("WhiteElo", "?"))
+            int(self.game.headers.get("BlackElo", "?"))
+        except ValueError:
+            self.skipped = True
+            return chess.pgn.SKIP
+
+    def result(self):
+        return chess.pgn.SKIP if self.skipped else super().result()
+
+def analyze_position_worker(board, game=None):
+    """
+    `game` identifies the game being analysed: python-chess sends ucinewgame
+    only when it changes, so Stockfish keeps its hash between plies of one
+    game. The board is sent as start position + moves, not as a bare FEN.
+    """
     global engine
     if engine is None:
         return None, 0, 0
     
-    info = engine.analyse(board, chess.engine.Limit(depth=DEPTH), multipv=5)
+    info = engine.analyse(board, chess.engine.Limit(depth=DEPTH), multipv=MULTIPV, game=game)
     
     if not info:
         return None, 0, 0
@@ -71,38 +206,58 @@ def process_single_game(game_data):
     board = game.board()
     
     for move in game.mainline_moves():
-        current_elo = white_elo if board.turn == chess.WHITE else black_elo
-
-
+        current_elo = white_elo if board.turn else black_elo # turn is chess.WHITE (True) or BLACK
+        
+        # Skip the opening and forced replies (a single legal move can't be a blunder)
+        if (board.fullmove_number < MIN_FULLMOVE or is_book_position(board)
+                or board.legal_moves.count() == 1):
+            board.push(move)
+            continue
         
         try:
-            best_move, best_score, analysis = analyze_position_worker(board)
+            # Move counters don't change the evaluation; dropping them lets
+            # transpositions and repeated openings hit the cache.
+            position = " ".join(board.fen().split(" ")[:4])
+            human_key = f"{position}|{move.uci()}"
+            cacheable = (eval_cache is not None
+                         and board.halfmove_clock < EVAL_CACHE_MAX_HALFMOVE_CLOCK
+                         and not has_repeated_position(board))
+            best_score, human_move_score = cache_get(position, human_key) if cacheable else (None, None)
             
-            if best_move is None:
-                board.push(move)
-                continue
+            if best_score is None:
+                best_move, best_score, analysis = analyze_position_worker(board, game)
+                
+                if best_move is None:
+                    board.push(move)
+                    continue
+                
+                # Keep every PV line: other games reach this position with other moves
+                new_scores = {position: best_score}
+                for pv in analysis:
+                    new_scores[f"{position}|{pv['pv'][0].uci()}"] = pv["score"].relative.score(mate_score=10000)
+                if cacheable:
+                    cache_put(new_scores)
+                human_move_score = new_scores.get(human_key)
 
             human_move = move
             
-            human_move_score = None
-            for pv in analysis:
-                if pv["pv"][0] == human_move:
-                    human_move_score = pv["score"].relative.score(mate_score=10000)
-                    break
-            
             if human_move_score is None:
-                board.push(human_move)
-                info_human = engine.analyse(board, chess.engine.Limit(depth=5)) 
+                # Search only the human move, from the same position and at the
+                # same depth as best_score, so the two scores are comparable
+                # (same side's point of view, no negation).
+                info_human = engine.analyse(board, chess.engine.Limit(depth=DEPTH),
+                                            root_moves=[human_move], game=game)
                 try:
-                    human_move_score = -info_human["score"].relative.score(mate_score=10000)
+                    human_move_score = info_human["score"].relative.score(mate_score=10000)
+                    if cacheable:
+                        cache_put({human_key: human_move_score})
                 except:
                     human_move_score = -9999 
-                board.pop() 
             
             score_diff = best_score - human_move_score
             
             data.append({
-                "fen": board.fen(),
+                "fen": position.split(" ", 1)[0], # == board.board_fen(), already serialized
                 "elo": current_elo,
                 "best_score": best_score,
                 "human_score": human_move_score,
@@ -119,6 +274,22 @@ def process_single_game(game_data):
         
     return data
 
+@contextmanager
+def open_row_writer():
+    """
+    Yields (path, write_rows) for streaming result rows to disk: zstd Parquet
+    when pyarrow is installed, CSV otherwise. Either way rows are written as
+    they arrive, never collected into one table.
+    """
+    if pa is not None:
+        with pq.ParquetWriter(OUTPUT_FILE, ROW_SCHEMA, compression="zstd") as writer:
+            yield OUTPUT_FILE, lambda rows: writer.write_table(pa.Table.from_pylist(rows, schema=ROW_SCHEMA))
+    else:
+        with open(CSV_OUTPUT_FILE, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=ROW_FIELDS)
+            writer.writeheader()
+            yield CSV_OUTPUT_FILE, writer.writerows
+
 def process_games_multiprocess():
     if not os.path.exists(PROCESSED_DIR):
         os.makedirs(PROCESSED_DIR)
@@ -127,47 +298,83 @@ def process_games_multiprocess():
         print(f"Error: {PGN_FILE} not found. Please place your PGN file there.")
         return
 
-    # Read all games into memory (or a list) to distribute
-    # CAUTION: If PGN is huge, this might eat RAM. 
-    # For 100k games it might be okay, but streaming is better.
-    # We will use imap to stream tasks as we read.
+    # Games are parsed lazily on the main thread and handed to the workers as
+    # they are read, so analysis starts right away and only the games in
+    # flight are held in memory (Pool's task queue applies the backpressure).
     
     cpu_count = os.cpu_count() or 1
     print(f"Starting processing with {cpu_count} cores...")
     
-    games_buffer = []
-    
-    with open(PGN_FILE) as f:
-        count = 0
-        while count < MAX_GAMES:
-            try:
-                game = chess.pgn.read_game(f)
+    def game_iter():
+        with open(PGN_FILE) as f:
+            count = 0
+            while count < MAX_GAMES:
+                try:
+                    game = chess.pgn.read_game(f, Visitor=EloFilterVisitor)
+                except Exception:
+                    break
                 if game is None:
                     break
-                games_buffer.append(game)
+                if game is chess.pgn.SKIP:
+                    continue
+                yield game
                 count += 1
-            except Exception:
-                break
-                
-    print(f"Loaded {len(games_buffer)} games. Distributing to workers...")
     
-    all_data = []
+    buffer = []
+    packed = [] # per-batch arrays for PACKED_OUTPUT_FILE, ~100 bytes per row
+    total_rows = 0
+    
+    def flush():
+        nonlocal buffer, total_rows
+        write_rows(buffer)
+        packed.append(pack_rows(buffer))
+        total_rows += len(buffer)
+        buffer = []
     
     # Use Pool
-    with multiprocessing.Pool(processes=cpu_count, initializer=init_worker) as pool:
-        # chunksize adjustment can help performance
+    with multiprocessing.Pool(processes=cpu_count, initializer=init_worker) as pool, \
+            open_row_writer() as (output_file, write_rows):
+        # One game per task: a game is dozens of depth-10 searches, so IPC cost
+        # is negligible, and game lengths vary too much for batching (a long
+        # game bundled into a chunk leaves other workers idle at the end).
         # Use imap_unordered to get results as soon as they are ready for the progress bar
-        results_iterator = pool.imap_unordered(process_single_game, games_buffer, chunksize=10)
+        results_iterator = pool.imap_unordered(process_single_game, game_iter(), chunksize=1)
         
-        # Use tqdm for progress bar
+        # Use tqdm for progress bar (the game count is unknown up front)
         from tqdm import tqdm
-        for res in tqdm(results_iterator, total=len(games_buffer), desc="Processing Games"):
-            all_data.extend(res)
+        for res in tqdm(results_iterator, total=MAX_GAMES, desc="Processing Games"):
+            buffer.extend(res)
+            if len(buffer) >= WRITE_BATCH_ROWS:
+                flush()
+        if buffer:
+            flush()
             
-    # Save to CSV
-    df = pd.DataFrame(all_data)
-    df.to_csv(OUTPUT_FILE, index=False)
-    print(f"Saved {len(df)} positions to {OUTPUT_FILE}")
+    print(f"Saved {total_rows} positions to {output_file}")
+    
+    # Written after the rows file so its mtime marks it as up to date
+    save_packed(packed, PACKED_OUTPUT_FILE)
+
+def pack_rows(rows):
+    """Packs result rows into the bitboards/elo/is_blunder arrays read by HumanChessDataset."""
+    import numpy as np
+    from bitboards import fens_to_bitboards
+    
+    return {
+        "bitboards": fens_to_bitboards([row["fen"] for row in rows]),
+        "elo": np.array([row["elo"] for row in rows], dtype=np.int16),
+        "is_blunder": np.array([row["is_blunder"] for row in rows], dtype=np.uint8),
+    }
+
+def save_packed(chunks, output_file):
+    """Concatenates pack_rows() chunks into the .npz layout of prepare_dataset.py."""
+    import numpy as np
+    
+    if not chunks:
+        return
+    np.savez_compressed(output_file, **{
+        key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]
+    })
+    print(f"Saved packed positions to {output_file}")
 
 if __name__ == "__main__":
     # creating the processed directory if it doesn't exist
@@ -0,0 +1,61 @@
+import torch
+import os
+import argparse
+from itertools import islice
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from dataset import HumanChessDataset, batch_loader
+from model import ChessBlunderCNN, BlunderProbability, default_quantized_engine
+from prepare_dataset import resolve_data_file
+
+# Configuration
+MODEL_DIR = "models"
+MODEL_NAME = "human-chess-blunder-cnn"
+INT8_FILE = "model_int8.pt"
+CALIBRATION_BATCHES = 100
+BATCH_SIZE = 256
+
+def quantize(model, calibration_loader, num_batches=CALIBRATION_BATCHES):
+    """
+    Post-training static int8 quantization (FX graph mode): convs and
+    linears run on int8 kernels, activation ranges come from calibration
+    batches. Returns a frozen TorchScript module ready for torch.jit.save;
+    like freeze_for_inference, it outputs probabilities.
+    """
+    engine = default_quantized_engine()
+    torch.backends.quantized.engine = engine
+    
+    model = model.to("cpu").eval()
+    example_inputs = (torch.zeros(1, 12, 8, 8), torch.zeros(1, 1))
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs)
+    
+    with torch.no_grad():
+        for board, elo, _ in islice(calibration_loader, num_batches):
+            prepared(board.float(), elo)
+    
+    quantized = convert_fx(prepared)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(BlunderProbability(quantized).eval(), example_inputs))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default=f"{MODEL_DIR}/{MODEL_NAME}", help="Local path or HF Repo ID")
+    parser.add_argument("--batches", type=int, default=CALIBRATION_BATCHES, help="Calibration batches")
+    args = parser.parse_args()
+    
+    data_file = resolve_data_file()
+    if not os.path.exists(data_file):
+        print(f"Error: {data_file} not found. Calibration needs the processed dataset.")
+        raise SystemExit(1)
+    
+    model = ChessBlunderCNN.from_pretrained(args.model)
+    loader = batch_loader(HumanChessDataset(data_file), BATCH_SIZE, shuffle=True)
+    
+    print(f"Calibrating on {args.batches} batches ({default_quantized_engine()} engine)...")
+    quantized = quantize(model, loader, args.batches)
+    
+    out_dir = args.model if os.path.isdir(args.model) else f"{MODEL_DIR}/{MODEL_NAME}"
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, INT8_FILE)
+    torch.jit.save(quantized, path)
+    print(f"Saved int8 model to {path}")
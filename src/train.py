@@ -1,15 +1,17 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, random_split
-from dataset import HumanChessDataset
+from torch.utils.data import random_split
+from torchmetrics.classification import BinaryAccuracy
+from dataset import HumanChessDataset, batch_loader
 from model import ChessBlunderCNN
+from export_model import export_all
+from prepare_dataset import resolve_data_file
 import os
 import argparse
 from huggingface_hub import HfApi
 
 # Configuration
-DATA_FILE = "data/processed/chess_complexity_data.csv"
 MODEL_DIR = "models"
 MODEL_NAME = "human-chess-blunder-cnn"
 BATCH_SIZE = 256 # Optimization: Increased batch size
@@ -17,16 +19,20 @@ LEARNING_RATE = 0.001
 
 def train(epochs=10, push_to_hub=False, repo_id=None):
     # Check if data exists
-    if not os.path.exists(DATA_FILE):
-        print(f"Error: {DATA_FILE} not found. Please run process_data.py first.")
+    data_file = resolve_data_file()
+    if not os.path.exists(data_file):
+        print(f"Error: {data_file} not found. Please run process_data.py first.")
         return
 
     # Device
-    device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+    if torch.cuda.is_available():
+        device = torch.device("cuda")
+    else:
+        device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
     print(f"Using device: {device}")
 
     # Data
-    dataset = HumanChessDataset(DATA_FILE)
+    dataset = HumanChessDataset(data_file)
     if len(dataset) == 0:
         print("Dataset is empty.")
         return
@@ -40,59 +46,87 @@ def train(epochs=10, push_to_hub=False, repo_id=None):
     # MPS does not support pin_memory properly yet
     use_pin_memory = True if device.type == "cuda" else False
     
-    train_loader = DataLoader(train_data, batch_size=BATCH_SIZE, shuffle=True, num_workers=num_workers, pin_memory=use_pin_memory)
-    val_loader = DataLoader(val_data, batch_size=BATCH_SIZE, num_workers=num_workers, pin_memory=use_pin_memory)
+    # Keep workers alive across epochs and let each prepare batches ahead of
+    # the device (both options are only valid with worker processes).
+    worker_options = {"persistent_workers": True, "prefetch_factor": 4} if num_workers > 0 else {}
+    
+    # Batches are unpacked whole (see dataset.batch_loader)
+    train_loader = batch_loader(train_data, BATCH_SIZE, shuffle=True, num_workers=num_workers,
+                                pin_memory=use_pin_memory, **worker_options)
+    val_loader = batch_loader(val_data, BATCH_SIZE, num_workers=num_workers,
+                              pin_memory=use_pin_memory, **worker_options)
 
     # Model
     model = ChessBlunderCNN().to(device)
     
+    # CUDA only: channels_last selects the NHWC cuDNN conv kernels and
+    # torch.compile removes per-layer Python dispatch (MPS support is still
+    # partial). `model` stays the eager module for saving; they share weights.
+    forward = model
+    memory_format = torch.contiguous_format
+    if device.type == "cuda":
+        memory_format = torch.channels_last
+        model = model.to(memory_format=memory_format)
+        forward = torch.compile(model, mode="reduce-overhead")
+    
     # Optimizer & Loss
     optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
-    criterion = nn.BCELoss() # Binary Cross Entropy
+    # Binary Cross Entropy on logits: fused with the sigmoid, numerically stable
+    criterion = nn.BCEWithLogitsLoss()
+    # Keeps its running counts on the device
+    val_accuracy = BinaryAccuracy().to(device)
 
     # Loop
     for epoch in range(epochs):
         model.train()
-        total_loss = 0
+        # Accumulated on the device; .item() once per epoch instead of a
+        # device sync every batch
+        total_loss = torch.zeros((), device=device)
         
         for board, elo, label in train_loader:
-            board, elo, label = board.to(device), elo.to(device), label.to(device)
+            board, elo, label = (board.to(device, non_blocking=True).float().contiguous(memory_format=memory_format),
+                                 elo.to(device, non_blocking=True),
+                                 label.to(device, non_blocking=True))
             
             optimizer.zero_grad()
-            output = model(board, elo)
+            output = forward(board, elo)
             loss = criterion(output, label)
             loss.backward()
             optimizer.step()
             
-            total_loss += loss.item()
+            total_loss += loss.detach()
             
         # Validation
         model.eval()
-        val_loss = 0
-        correct = 0
-        total = 0
+        val_loss = torch.zeros((), device=device)
+        val_accuracy.reset()
         with torch.no_grad():
             for board, elo, label in val_loader:
-                board, elo, label = board.to(device), elo.to(device), label.to(device)
-                output = model(board, elo)
-                val_loss += criterion(output, label).item()
-                
-                predicted = (output > 0.5).float()
-                correct += (predicted == label).sum().item()
-                total += label.size(0)
+                board, elo, label = (board.to(device, non_blocking=True).float().contiguous(memory_format=memory_format),
+                                     elo.to(device, non_blocking=True),
+                                     label.to(device, non_blocking=True))
+                output = forward(board, elo)
+                val_loss += criterion(output, label)
+                # Probabilities, not logits: BinaryAccuracy only applies the
+                # sigmoid itself when some value falls outside [0, 1]
+                val_accuracy.update(torch.sigmoid(output), label.int())
         
         print(f"Epoch {epoch+1}/{epochs} | "
-              f"Train Loss: {total_loss/len(train_loader):.4f} | "
-              f"Val Loss: {val_loss/len(val_loader):.4f} | "
-              f"Val Acc: {100 * correct / total:.2f}%")
+              f"Train Loss: {total_loss.item()/len(train_loader):.4f} | "
+              f"Val Loss: {val_loss.item()/len(val_loader):.4f} | "
+              f"Val Acc: {100 * val_accuracy.compute().item():.2f}%")
 
     # Save locally
     if not os.path.exists(MODEL_DIR):
         os.makedirs(MODEL_DIR)
         
     print(f"Saving model to {MODEL_DIR}/{MODEL_NAME}...")
+    model = model.to(memory_format=torch.contiguous_format) # safetensors needs contiguous weights
     model.save_pretrained(f"{MODEL_DIR}/{MODEL_NAME}")
     
+    # ONNX and frozen TorchScript copies for inference in the API
+    export_all(model, f"{MODEL_DIR}/{MODEL_NAME}")
+    
     # Push to Hub
     if push_to_hub and repo_id:
         print(f"Pushing to Hugging Face Hub: {repo_id}...")